@@ -1,29 +1,111 @@
 import os
 import sqlite3
-import uuid
+import threading
 import json
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from .utils import get_drona_dir
 
+# Connections are cached per thread (sqlite3 connections may not be shared
+# across threads by default) and the schema is created once per database path
+# per process, so handlers that build a JobHistoryManager per request don't
+# pay for a fresh connect and DDL round-trip every time.
+_local = threading.local()
+_schema_ready = set()
+
+# Bumped on every job saved by this process. Together with PRAGMA
+# data_version (which only reports commits made by *other* connections) it
+# tells a thread whether its cached /history body is still current.
+_history_writes = 0
+_history_writes_lock = threading.Lock()
+
+# Statements are kept as constants so every call hands sqlite3 the same text
+# and hits its per-connection prepared statement cache.
+_GET_JOB_SQL = "SELECT env_params FROM job_history WHERE drona_id = ?"
+_HISTORY_SQL = "SELECT env_params FROM job_history ORDER BY start_time DESC"
+_NEXT_ID_SQL = (
+    "SELECT COALESCE(MAX(CAST(drona_id AS INTEGER)), 0) + 1 FROM job_history"
+)
+_INSERT_JOB_SQL = """
+    INSERT INTO job_history
+    (drona_id, job_name, environment, start_time, status, env_params)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _get_conn(db_path):
+    """Return this thread's cached connection to db_path, opening it on first use."""
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        # Autocommit mode: reads run outside any transaction and writers open
+        # their own with an explicit BEGIN, so sqlite3 never has to inspect
+        # statements to decide when to start one implicitly.
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        conn.execute("PRAGMA foreign_keys = ON")
+        # WAL with synchronous=NORMAL skips the fsync on every commit while
+        # staying durable across application crashes; a larger page cache and
+        # mmap keep repeated history reads out of the read() syscall path.
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA cache_size = -20000")
+        conn.execute("PRAGMA mmap_size = 268435456")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conns[db_path] = conn
+    return conn
+
+
+def _coerce_environment(runtime):
+    """Return the value stored in the job_history environment column."""
+    # Submitted forms carry runtime as a plain string; check that first.
+    if type(runtime) is str and runtime:
+        return runtime
+    if type(runtime) is dict:
+        return runtime.get('value') or runtime.get('label') or 'unknown'
+    return str(runtime or 'unknown')
+
+
+@lru_cache(maxsize=512)
+def _split_label_key(key):
+    """Split a form field name into (base_key, is_label) for '<base>_label' fields."""
+    if key.endswith('_label'):
+        return key[:-6], True
+    return key, False
+
+
+def _note_history_write():
+    global _history_writes
+    with _history_writes_lock:
+        _history_writes += 1
+
+
+@lru_cache(maxsize=8)
+def _resolve_db_path(drona_dir):
+    """Create the jobs directory under drona_dir once and return the database path."""
+    base_dir = os.path.join(drona_dir, 'jobs')
+    Path(base_dir).mkdir(parents=True, exist_ok=True)
+    return os.path.join(base_dir, 'job_history.db')
+
 
 class JobHistoryManager:
     def __init__(self):
-        base_dir = os.path.join(get_drona_dir(), 'jobs')
         try:
-            Path(base_dir).mkdir(parents=True, exist_ok=True)
-            self.db_path = os.path.join(base_dir, 'job_history.db')
+            self.db_path = _resolve_db_path(get_drona_dir())
             self._ensure_database()
         except PermissionError:
             self.db_path = None
 
     def _ensure_database(self):
         """Create database and tables if they don't exist."""
-        if not self.db_path:
+        if not self.db_path or self.db_path in _schema_ready:
             return
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
+            conn = _get_conn(self.db_path)
+            conn.execute("BEGIN IMMEDIATE")
+            with conn:
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS job_history (
                         drona_id     TEXT PRIMARY KEY,
@@ -42,7 +124,7 @@ class JobHistoryManager:
                     CREATE INDEX IF NOT EXISTS idx_job_history_start_time 
                     ON job_history(start_time)
                 """)
-                conn.commit()
+            _schema_ready.add(self.db_path)
         except (sqlite3.Error, PermissionError):
             pass
 
@@ -50,71 +132,74 @@ class JobHistoryManager:
         if not self.db_path:
             return None
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.execute(
-                    "SELECT * FROM job_history WHERE drona_id = ?",
-                    (str(job_id),)
-                )
+            with _get_conn(self.db_path) as conn:
+                cursor = conn.execute(_GET_JOB_SQL, (str(job_id),))
                 row = cursor.fetchone()
                 
                 if row:
                     # Parse env_params and return it as the job
-                    env_params = json.loads(row['env_params'])
+                    env_params = json.loads(row[0])
                     return env_params
                 return None
         except (sqlite3.Error, PermissionError, json.JSONDecodeError):
             return None
 
+    def get_job_json(self, job_id):
+        """Return the stored env_params JSON text for job_id, or None."""
+        if not self.db_path:
+            return None
+        try:
+            with _get_conn(self.db_path) as conn:
+                row = conn.execute(_GET_JOB_SQL, (str(job_id),)).fetchone()
+                return row[0] if row else None
+        except (sqlite3.Error, PermissionError):
+            return None
+
     def transform_form_data(self, form_data, location):
         transformed = {}
-        pairs = {}
+        labels = {}
         for key, value in form_data.items():
-            if key.endswith('_label'):
-                base_key = key[:-6]
-                if base_key not in pairs:
-                    pairs[base_key] = {}
-                pairs[base_key]['label'] = value
+            base_key, is_label = _split_label_key(key)
+            if is_label:
+                labels[base_key] = value
             else:
-                if key not in pairs:
-                    pairs[key] = {}
-                pairs[key]['value'] = value
-        for key, pair in pairs.items():
-            if 'value' in pair and 'label' in pair:
-                transformed[key] = {
-                    'value': pair['value'],
-                    'label': pair['label']
-                }
+                transformed[key] = value
+        for key, label in labels.items():
+            if key in transformed:
+                transformed[key] = {'value': transformed[key], 'label': label}
             else:
-                transformed[key] = form_data[key]
+                transformed[key + '_label'] = label
 
         for key, value in transformed.items():
-            if not isinstance(value, str):
+            # Only JSON arrays of file descriptors are rewritten, so skip the
+            # parse (and the JSONDecodeError it raises for most plain values)
+            # unless the string can be one.
+            if not isinstance(value, str) or not value.lstrip().startswith('['):
                 continue
             try:
                 value = json.loads(value)
-                print(key, value, isinstance(value, list))
-                if isinstance(value, list) and all(isinstance(item, dict) and 'filename' in item and 'filepath' in item for item in value):
-                    transformed[key] = [
-                        {
-                        **item,
-                        'filepath': os.path.join(location, item['filename'])
-                        }
-                        for item in value
-                ]
             except json.JSONDecodeError:
                 continue
+            if isinstance(value, list) and all(isinstance(item, dict) and 'filename' in item and 'filepath' in item for item in value):
+                if not location:
+                    # No upload location to re-root against; keep the paths
+                    # the client sent.
+                    transformed[key] = value
+                    continue
+                transformed[key] = [
+                    {**item, 'filepath': os.path.join(location, item['filename'])}
+                    for item in value
+                ]
         return transformed
 
     def save_job(self, job_data, files, generated_files):
-        timestamp = datetime.now().isoformat()
-        user = os.getenv('USER')
-        job_id = str(int(uuid.uuid4().int & 0xFFFFFFFFF))
+        if not self.db_path:
+            return False
+
+        timestamp = datetime.now().isoformat(timespec='seconds')
 
-        form_data = self.transform_form_data(dict(job_data), job_data.get('location'))
-        
         job_record = {
-            'job_id': job_id,
+            'job_id': None,  # allocated inside the insert transaction below
             'name': job_data.get('name'),
             'location': job_data.get('location'),
             'runtime': job_data.get('runtime'),
@@ -128,56 +213,71 @@ class JobHistoryManager:
             'script': job_data.get('run_command'),
             'driver': job_data.get('driver'),
             'additional_files': json.loads(job_data.get('additional_files', '{}')),
-            'form_data': form_data
+            'form_data': self.transform_form_data(job_data, job_data.get('location'))
         }
 
-        if not self.db_path:
-            return False
-
-        # Extract environment for the database column
-        runtime = job_data.get('runtime')
-        if isinstance(runtime, dict):
-            environment = runtime.get('value') or runtime.get('label') or 'unknown'
-        else:
-            environment = str(runtime or 'unknown')
+        environment = _coerce_environment(job_data.get('runtime'))
 
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
-                conn.execute("""
-                    INSERT INTO job_history 
-                    (drona_id, job_name, environment, start_time, status, env_params)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    job_id,
+            conn = _get_conn(self.db_path)
+            # BEGIN IMMEDIATE takes the database write lock up front, so id
+            # allocation and insert are serialised across app processes.
+            conn.execute("BEGIN IMMEDIATE")
+            with conn:
+                job_record['job_id'] = str(conn.execute(_NEXT_ID_SQL).fetchone()[0])
+                conn.execute(_INSERT_JOB_SQL, (
+                    job_record['job_id'],
                     job_data.get('name'),
                     environment,
                     timestamp,
                     None,  # status is None by default
-                    json.dumps(job_record)
+                    json.dumps(job_record, separators=(",", ":"))
                 ))
-                conn.commit()
-                return job_record
         except (sqlite3.Error, PermissionError):
             return False
+        _note_history_write()
+        return job_record
+
+    def _iter_env_params(self):
+        """Yield the stored env_params text of each job, newest first.
+
+        Rows are stepped from the cursor one at a time rather than fetched
+        all at once, so no list of row tuples is built alongside the output.
+        """
+        with _get_conn(self.db_path) as conn:
+            for row in conn.execute(_HISTORY_SQL):
+                yield row[0]
 
     def get_user_history(self):
         if not self.db_path:
             return []
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.execute(
-                    "SELECT * FROM job_history ORDER BY start_time DESC"
-                )
-                rows = cursor.fetchall()
-                
-                history = []
-                for row in rows:
-                    # Parse and return just the env_params (job_record)
-                    env_params = json.loads(row['env_params'])
-                    history.append(env_params)
-                
-                return history
+            # Parse and return just the env_params (job_record)
+            return [json.loads(env_params) for env_params in self._iter_env_params()]
         except (sqlite3.Error, PermissionError, json.JSONDecodeError):
             return []
+
+    def get_user_history_json(self):
+        """Return the history as a JSON array string built from the stored
+        env_params text, skipping the decode/re-encode round trip.
+
+        The body is cached per thread until this process saves a job or
+        PRAGMA data_version reports a commit from another connection, so
+        repeated requests against an idle history skip the table scan.
+        """
+        if not self.db_path:
+            return '[]'
+        try:
+            conn = _get_conn(self.db_path)
+            stamp = (conn.execute("PRAGMA data_version").fetchone()[0], _history_writes)
+            cache = getattr(_local, 'history', None)
+            if cache is None:
+                cache = _local.history = {}
+            cached = cache.get(self.db_path)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            body = '[' + ','.join(self._iter_env_params()) + ']'
+        except (sqlite3.Error, PermissionError):
+            return '[]'
+        cache[self.db_path] = (stamp, body)
+        return body
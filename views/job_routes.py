@@ -81,18 +81,18 @@ def preview_job_route():
 def get_history_route():
     """Get job history for the current user"""
     history_manager = JobHistoryManager()
-    return jsonify(history_manager.get_user_history())
+    return Response(history_manager.get_user_history_json(), mimetype='application/json')
 
 def get_job_from_history_route(job_id):
     """Get details for a specific job from history"""
     history_manager = JobHistoryManager()
 
-    job_data = history_manager.get_job(job_id)
+    job_data = history_manager.get_job_json(job_id)
 
     if not job_data:
         return "Job not found", 404
 
-    return jsonify(job_data)
+    return Response(job_data, mimetype='application/json')
 
 def register_job_routes(blueprint, socketio_instance=None):
     """Register all job-related routes to the blueprint and initialize socketio"""